@@ -1,15 +1,24 @@
 import cv2
 import time
+import logging
+from logging.handlers import RotatingFileHandler
 import numpy as np
 from datetime import datetime
 import os
 import requests
 from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder
 from urllib3.util.retry import Retry
 import json
 import uuid
-import glob
 import hashlib
+import mimetypes
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+
+logger = logging.getLogger("prevex")
 
 class RaspberryPiSystem:
     def __init__(self, device_id=None, api_url="http://c4kgwso4ggcgk44080kc4ooo.157.90.23.234.sslip.io", temp_dir="temp_storage"):
@@ -17,198 +26,562 @@ class RaspberryPiSystem:
         self.incrementapi = "http://g04swcgcwsco40kw4s4gwko8.157.90.23.234.sslip.io/vitals/save"
         self.api_url = api_url
         self.temp_dir = temp_dir
+        
+        # Prebuilt endpoint URLs and request payloads for the hot path
+        self.heartbeat_url = f"{self.api_url}/api/heartbeat"
+        self.upload_url = f"{self.api_url}/api/upload-image"
+        self.upload_batch_url = f"{self.api_url}/api/upload-batch"
+        self.cleanup_url = f"{self.api_url}/api/cleanup-orphaned"
+        self.device_payload = {"device_id": self.device_id}
+        self.heartbeat_payloads = {status: {"device_id": self.device_id, "status": status}
+                                   for status in ("online", "offline", "disconnected")}
         self.last_heartbeat = None
+        self.heartbeat_interval = 30  # seconds
+        self.heartbeat_retry_delay = 5  # seconds
+        self.next_heartbeat = 0.0  # time.monotonic() deadline for the next heartbeat
+        self.black_threshold = 8  # frames whose brightest pixel is below this count as black
+        self.last_frame_hash = None
+        # Capture format: MJPG is decoded by libjpeg-turbo instead of a software YUYV->BGR conversion
+        self.capture_fourcc = "MJPG"
+        self.capture_width = 1280
+        self.capture_height = 720
+        self.capture_fps = 5
         self.is_connected = False
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 10
         self.reconnect_delay = 5  # seconds
+        # Screenshots are encoded as JPEG: much faster to encode and far smaller to upload than PNG
+        self.image_ext = ".jpg"
+        self.image_mime = "image/jpeg"
+        self.legacy_image_exts = (".png",)  # left in temp storage by versions before the JPEG switch
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), 85,
+                              int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+        
+        # Frames waiting to be encoded and uploaded by the background workers
+        self.upload_workers = 2
+        self.upload_queue = queue.Queue(maxsize=4)
+        self.upload_pool = None
+        self.upload_futures = []
+        self.shutdown_timeout = 60  # seconds to let queued frames finish uploading on exit
+        self.upload_timeout = 30  # seconds, so a stalled server can't hang the workers
+        self.upload_batch_size = 5
+        self.batch_upload_supported = True  # cleared if the server lacks the batch endpoint
+        
+        # Images whose upload failed wait in temp storage and are retried by the backlog worker
+        self.max_pending_images = 500  # oldest ones beyond this are dropped to bound disk use
+        self.backlog_retry_interval = 60  # seconds
+        self.backlog_stop = threading.Event()
+        self.backlog_wakeup = threading.Event()  # set when the network is back and a backlog exists
+        self.backlog_pending = False
+        
+        # Heartbeats and vitals updates each get a sender thread, started by capture_screen,
+        # so a slow vitals host can never hold up a heartbeat
+        self.request_stop = threading.Event()
+        self.request_threads = []
+        self.request_shutdown_timeout = 15  # seconds to flush owed vitals updates on exit
+        # Vitals updates owed for uploaded images, drained one request at a time by the vitals sender
+        self.pending_increments = 0
+        self.increment_lock = threading.Lock()
+        self.increment_wakeup = threading.Event()
+        self.increment_retry_delay = 30  # seconds
         
         # Create temp directory
         os.makedirs(self.temp_dir, exist_ok=True)
         
         # Setup requests session with retry strategy
         self.session = self._setup_requests_session()
+        self.status_session = self._setup_status_session()
+        self.status_timeout = 3  # seconds, for status updates that block capture or shutdown
         
-        # Clean up temp storage on startup
+        # Clean up temp storage on startup; leftover images are uploaded by the backlog worker
         self.cleanup_temp_storage()
         
-        print(f"Raspberry Pi System initialized with ID: {self.device_id}")
+        logger.info("Raspberry Pi System initialized with ID: %s", self.device_id)
     
     def _setup_requests_session(self):
         """Setup requests session with retry strategy and timeouts"""
         session = requests.Session()
+        session.headers["User-Agent"] = "PrevexPi/1.0"
         
-        # Define retry strategy
+        # Uploads, vitals increments and cleanup are not idempotent, so only retry
+        # connection failures, which happen before the request reaches the server
         retry_strategy = Retry(
             total=3,  # Total number of retries
-            backoff_factor=1,  # Wait time between retries: {backoff factor} * (2 ^ ({number of total retries} - 1))
+            connect=3,
+            read=0,
+            status=0,
+            backoff_factor=0.3,  # Wait time between retries: {backoff factor} * (2 ^ ({number of total retries} - 1))
+        )
+        # Heartbeats are idempotent status updates, so server errors are retried too
+        heartbeat_retry_strategy = Retry(
+            total=5,
+            backoff_factor=0.3,
             status_forcelist=[429, 500, 502, 503, 504],  # HTTP status codes to retry on
+            allowed_methods=["POST"],
         )
         
-        # Mount adapter with retry strategy
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # Mount adapters with retry strategy; keep a small pool of
+        # keep-alive connections per API host (one host pool each)
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry_strategy)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
+        session.mount(self.heartbeat_url,
+                      HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=heartbeat_retry_strategy))
         
         return session
     
-    def check_api_connectivity(self):
-        """Check if API endpoint is reachable"""
-        try:
-            # Try a simple HEAD request with short timeout
-            response = self.session.head(f"{self.api_url}/api/heartbeat", timeout=5)
-            return response.status_code in [200, 404, 405]  # 404/405 means server is reachable
-        except requests.exceptions.RequestException as e:
-            print(f"API connectivity check failed: {e}")
-            return False
+    def _setup_status_session(self):
+        """Setup a session without retries for status updates that block the caller"""
+        session = requests.Session()
+        session.headers["User-Agent"] = "PrevexPi/1.0"
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
     
     def _generate_device_id(self):
-        """Generate a unique device identifier"""
+        """Generate a unique device identifier, cached on disk so it stays stable across reboots"""
+        id_path = os.path.expanduser("~/.prevex_device_id")
+        try:
+            with open(id_path) as f:
+                device_id = f.read().strip()
+            if device_id:
+                return device_id
+        except OSError:
+            pass
+        
         # Use MAC address and system info to create a unique ID
         try:
             # Try to get MAC address
             mac = ':'.join(['{:02x}'.format((uuid.getnode() >> ele) & 0xff) 
                            for ele in range(0,8*6,8)][::-1])
-            return hashlib.md5(f"{mac}-{os.uname().nodename}".encode()).hexdigest()[:12]
+            device_id = hashlib.md5(f"{mac}-{os.uname().nodename}".encode()).hexdigest()[:12]
         except:
             # Fallback to random UUID
-            return str(uuid.uuid4())[:12]
+            device_id = str(uuid.uuid4())[:12]
+        
+        # Persist atomically so a partial write can never change the identity
+        try:
+            tmp_path = f"{id_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(device_id)
+            os.replace(tmp_path, id_path)
+        except OSError as e:
+            logger.warning("Could not cache device ID: %s", e)
+        return device_id
     
     def cleanup_temp_storage(self):
         """Clean up temporary storage and check for orphaned images on server"""
-        print("Cleaning up temporary storage...")
+        logger.info("Cleaning up temporary storage...")
         
-        # Clean local temp files
-        temp_files = glob.glob(os.path.join(self.temp_dir, "*.png"))
-        for file_path in temp_files:
-            try:
-                os.remove(file_path)
-                print(f"Removed local temp file: {file_path}")
-            except Exception as e:
-                print(f"Error removing {file_path}: {e}")
+        # Remove partial writes left by a crash, unlinking in parallel since each call mostly waits on I/O
+        with os.scandir(self.temp_dir) as entries:
+            partial_files = [entry.path for entry in entries if entry.name.endswith(".part")]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            removed = sum(pool.map(self._remove_temp_file, partial_files))
+        if partial_files:
+            logger.info("Removed %s/%s partial temp files", removed, len(partial_files))
+        
+        # Complete images are kept so they can still be uploaded
+        pending = self._prune_pending_images()
+        if pending:
+            logger.info("Keeping %s pending images for upload", len(pending))
         
         # Check with server for orphaned images
         try:
-            response = self.session.post(f"{self.api_url}/api/cleanup-orphaned", 
-                                       json={"device_id": self.device_id}, timeout=10)
+            response = self.session.post(self.cleanup_url, 
+                                       json=self.device_payload, timeout=10)
             if response.status_code == 200:
                 result = response.json()
-                print(f"Server cleanup completed: {result.get('message', 'Unknown')}")
+                logger.info("Server cleanup completed: %s", result.get('message', 'Unknown'))
             else:
-                print(f"Server cleanup failed: {response.status_code}")
+                logger.warning("Server cleanup failed: %s", response.status_code)
         except Exception as e:
-            print(f"Could not contact server for cleanup: {e}")
+            logger.warning("Could not contact server for cleanup: %s", e)
     
-    def send_heartbeat(self, status="online"):
-        """Send heartbeat to API to indicate device status"""
-        # Check API connectivity first
-        if not self.check_api_connectivity():
-            print(f"Cannot send heartbeat - API not reachable")
+    def _remove_temp_file(self, file_path):
+        """Remove a single temp file, returning whether it succeeded"""
+        try:
+            os.remove(file_path)
+            return True
+        except Exception as e:
+            logger.warning("Error removing %s: %s", file_path, e)
             return False
-            
+    
+    def _pending_images(self):
+        """List images waiting in temp storage, oldest first"""
+        with os.scandir(self.temp_dir) as entries:
+            return sorted(entry.path for entry in entries
+                          if entry.name.endswith((self.image_ext, *self.legacy_image_exts)))
+    
+    def _prune_pending_images(self):
+        """Drop the oldest pending images beyond max_pending_images and return the rest"""
+        pending = self._pending_images()
+        excess = pending[:max(0, len(pending) - self.max_pending_images)]
+        if excess:
+            # Unlink in parallel since each call mostly waits on I/O
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                removed = sum(pool.map(self._remove_temp_file, excess))
+            logger.warning("Dropped %s oldest pending images over the limit of %s", removed, self.max_pending_images)
+        return pending[len(excess):]
+    
+    def upload_pending_images(self):
+        """
+        Upload images left in temp storage by failed uploads or a previous run (e.g. after a crash),
+        in batches. Returns True if no pending images remain.
+        """
+        pending = self._prune_pending_images()
+        if not pending:
+            return True
+        
+        logger.info("Uploading %s pending images from temp storage...", len(pending))
+        while pending:
+            if self.backlog_stop.is_set():
+                # Shutting down, leave the rest for the next run
+                return False
+            batch, pending = pending[:self.upload_batch_size], pending[self.upload_batch_size:]
+            uploaded, rejected = self.upload_images(batch)
+            for file_path in uploaded:
+                self._remove_temp_file(file_path)
+            for file_path in rejected:
+                # Retrying would block the rest of the backlog behind it forever
+                logger.warning("Server rejected %s, discarding it", file_path)
+                self._remove_temp_file(file_path)
+            if len(uploaded) + len(rejected) < len(batch):
+                # Server is likely unreachable, keep the rest for the next attempt
+                logger.warning("Pending image upload failed, will retry later")
+                return False
+        return True
+    
+    def _backlog_worker(self):
+        """Retry pending uploads periodically, or as soon as a live upload succeeds, until backlog_stop is set"""
+        while not self.backlog_stop.is_set():
+            try:
+                self.backlog_pending = not self.upload_pending_images()
+            except Exception as e:
+                logger.error("Backlog worker error: %s", e)
+            self.backlog_wakeup.wait(self.backlog_retry_interval)
+            self.backlog_wakeup.clear()
+    
+    def send_heartbeat(self, status="online", quick=False):
+        """
+        Send heartbeat to API to indicate device status.
+        Background heartbeats are retried with backoff by the session adapter; quick ones
+        use a short timeout and no retries, for calls that block capture or shutdown.
+        """
         try:
-            response = self.session.post(f"{self.api_url}/api/heartbeat", 
-                                       json={"device_id": self.device_id, "status": status}, 
-                                       timeout=10)
+            payload = self.heartbeat_payloads.get(status) or {"device_id": self.device_id, "status": status}
+            if quick:
+                response = self.status_session.post(self.heartbeat_url, json=payload,
+                                                    timeout=self.status_timeout)
+            else:
+                response = self.session.post(self.heartbeat_url, 
+                                           json=payload, 
+                                           timeout=10)
             if response.status_code == 200:
                 self.last_heartbeat = datetime.now()
+                self.next_heartbeat = time.monotonic() + self.heartbeat_interval
                 if status == "online":
-                    print(f"Heartbeat sent successfully at {self.last_heartbeat}")
+                    logger.debug("Heartbeat sent successfully at %s", self.last_heartbeat)
                 else:
-                    print(f"Status update sent: {status} at {self.last_heartbeat}")
+                    logger.info("Status update sent: %s at %s", status, self.last_heartbeat)
                 return True
             else:
-                print(f"Heartbeat failed with status code: {response.status_code}")
+                logger.warning("Heartbeat failed with status code: %s", response.status_code)
                 if response.text:
-                    print(f"Response: {response.text}")
+                    logger.warning("Response: %s", response.text)
                 return False
         except requests.exceptions.Timeout:
-            print("Heartbeat error: Request timed out")
+            logger.warning("Heartbeat error: Request timed out")
             return False
         except requests.exceptions.ConnectionError as e:
-            print(f"Heartbeat error: Connection failed - {e}")
+            logger.warning("Heartbeat error: Connection failed - %s", e)
             return False
         except requests.exceptions.RequestException as e:
-            print(f"Heartbeat error: {e}")
+            logger.warning("Heartbeat error: %s", e)
             return False
         except Exception as e:
-            print(f"Heartbeat error: Unexpected error - {e}")
+            logger.error("Heartbeat error: Unexpected error - %s", e)
             return False
     
-    def upload_image(self, image_path):
-        """Upload image to API"""
+    def _image_mime(self, image_path):
+        """MIME type for an image file, so legacy PNGs are not uploaded as JPEG"""
+        return mimetypes.guess_type(image_path)[0] or self.image_mime
+    
+    def _is_rejected(self, status_code):
+        """
+        Whether the server refused the image itself, so retrying it is pointless.
+        Auth and routing errors, timeouts and rate limits affect every upload, so those are retried.
+        """
+        return (status_code is not None and 400 <= status_code < 500
+                and status_code not in [401, 403, 404, 405, 408, 429])
+    
+    def _send_image(self, image_path, data=None):
+        """POST an image to the API, returning the response status code, or None if the request failed"""
         try:
-            with open(image_path, 'rb') as f:
-                files = {'image': f}
-                data = {'device_id': self.device_id}
-                response = requests.post(f"{self.api_url}/api/upload-image", 
-                                      files=files, data=data)
+            with ExitStack() as stack:
+                if data is None:
+                    # Stream the multipart body from disk instead of buffering it
+                    data = stack.enter_context(open(image_path, 'rb'))
+                encoder = MultipartEncoder(fields={
+                    'device_id': self.device_id,
+                    'image': (os.path.basename(image_path), data, self._image_mime(image_path)),
+                })
+                response = self.session.post(self.upload_url, 
+                                           data=encoder,
+                                           headers={'Content-Type': encoder.content_type},
+                                           timeout=self.upload_timeout)
             
             if response.status_code == 200:
-                print(f"Image uploaded successfully: {os.path.basename(image_path)}")
-                r = requests.get(self.incrementapi)
-                if r.status_code == 200:
-                    print("Saved")
-                return True
+                logger.debug("Image uploaded successfully: %s", os.path.basename(image_path))
+                self._record_upload()
             else:
-                print(f"Image upload failed: {response.status_code} - {response.text}")
-                return False
+                logger.warning("Image upload failed: %s - %s", response.status_code, response.text)
+            return response.status_code
         except Exception as e:
-            print(f"Image upload error: {e}")
-            return False
+            logger.error("Image upload error: %s", e)
+            return None
+    
+    def upload_image(self, image_path, data=None):
+        """Upload image to API, from the encoded data if given, otherwise from image_path on disk"""
+        return self._send_image(image_path, data) == 200
+    
+    def upload_images(self, image_paths):
+        """
+        Upload several images in a single multipart request to save round-trips.
+        Falls back to one request per image if the server has no batch endpoint or refuses the batch.
+        Returns the paths that were uploaded and the paths the server rejected, in order.
+        """
+        if self.batch_upload_supported and len(image_paths) > 1:
+            try:
+                with ExitStack() as stack:
+                    fields = [('device_id', self.device_id)]
+                    for image_path in image_paths:
+                        f = stack.enter_context(open(image_path, 'rb'))
+                        fields.append(('image', (os.path.basename(image_path), f, self._image_mime(image_path))))
+                    encoder = MultipartEncoder(fields=fields)
+                    response = self.session.post(self.upload_batch_url,
+                                               data=encoder,
+                                               headers={'Content-Type': encoder.content_type},
+                                               timeout=self.upload_timeout)
+                
+                if response.status_code == 200:
+                    logger.info("Uploaded batch of %s images", len(image_paths))
+                    for _ in image_paths:
+                        self._record_upload()
+                    return list(image_paths), []
+                elif response.status_code in [404, 405, 413]:
+                    # No batch endpoint, or batches are larger than the server (or a proxy) accepts
+                    logger.info("Batch upload not usable (%s), uploading images individually", response.status_code)
+                    self.batch_upload_supported = False
+                elif self._is_rejected(response.status_code):
+                    # One bad image fails the whole batch, find it by uploading them one at a time
+                    logger.warning("Batch upload rejected: %s - %s", response.status_code, response.text)
+                else:
+                    logger.warning("Batch upload failed: %s - %s", response.status_code, response.text)
+                    return [], []
+            except Exception as e:
+                logger.error("Batch upload error: %s", e)
+                return [], []
+        
+        uploaded, rejected = [], []
+        for image_path in image_paths:
+            status_code = self._send_image(image_path)
+            if status_code == 200:
+                uploaded.append(image_path)
+            elif self._is_rejected(status_code):
+                rejected.append(image_path)
+            else:
+                break
+        return uploaded, rejected
+    
+    def _record_upload(self):
+        """Count an uploaded image for the vitals sender, never affecting the upload result"""
+        with self.increment_lock:
+            self.pending_increments += 1
+        self.increment_wakeup.set()
+    
+    def _send_increment(self):
+        """Send the vitals increment request, returning whether it succeeded"""
+        try:
+            r = self.session.get(self.incrementapi, timeout=10)
+            if r.status_code == 200:
+                logger.debug("Saved")
+                return True
+            logger.warning("Vitals update failed: %s", r.status_code)
+        except Exception as e:
+            logger.warning("Vitals update error: %s", e)
+        return False
+    
+    def _vitals_worker(self):
+        """Send owed vitals updates one at a time until request_stop is set and none are left"""
+        while True:
+            with self.increment_lock:
+                owed = self.pending_increments > 0
+                if owed:
+                    self.pending_increments -= 1
+            if not owed:
+                if self.request_stop.is_set():
+                    return
+                self.increment_wakeup.wait()
+                self.increment_wakeup.clear()
+                continue
+            if not self._send_increment():
+                with self.increment_lock:
+                    self.pending_increments += 1
+                # Vitals host unreachable, back off; on shutdown the unsent count is logged
+                if self.request_stop.wait(self.increment_retry_delay):
+                    return
+    
+    def _heartbeat_worker(self):
+        """Send an online heartbeat every heartbeat_interval seconds until request_stop is set"""
+        while not self.request_stop.is_set():
+            if time.monotonic() >= self.next_heartbeat:
+                self.send_heartbeat("online")
+            # Retry soon after a failure, otherwise sleep until the next deadline
+            self.request_stop.wait(max(self.next_heartbeat - time.monotonic(), self.heartbeat_retry_delay))
+    
+    def _open_capture(self, device):
+        """Open the video device and configure its format and buffering"""
+        cap = cv2.VideoCapture(device)
+        if cap.isOpened():
+            # Pin pixel format and resolution so the driver and decode path stay stable
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.capture_fourcc))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.capture_width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.capture_height)
+            cap.set(cv2.CAP_PROP_FPS, self.capture_fps)
+            # Frames are sampled every few seconds, so a deep V4L2 buffer only yields stale frames
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
     
     def attempt_reconnection(self, device):
         """Attempt to reconnect to video source"""
         self.reconnect_attempts += 1
-        print(f"Attempting to reconnect to {device} (attempt {self.reconnect_attempts}/{self.max_reconnect_attempts})")
+        logger.warning("Attempting to reconnect to %s (attempt %s/%s)", device, self.reconnect_attempts, self.max_reconnect_attempts)
         
         # Send disconnected status to backend
-        self.send_heartbeat("disconnected")
+        self.send_heartbeat("disconnected", quick=True)
         
         if self.reconnect_attempts >= self.max_reconnect_attempts:
-            print(f"Max reconnection attempts reached. Stopping reconnection attempts.")
+            logger.error("Max reconnection attempts reached. Stopping reconnection attempts.")
             return None
         
         # Wait before attempting reconnection
         time.sleep(self.reconnect_delay)
         
         # Try to open the video capture
-        cap = cv2.VideoCapture(device)
+        cap = self._open_capture(device)
         if cap.isOpened():
-            print(f"Successfully reconnected to {device}")
+            logger.info("Successfully reconnected to %s", device)
             self.is_connected = True
             self.reconnect_attempts = 0
-            self.send_heartbeat("online")
+            self.send_heartbeat("online", quick=True)
             return cap
         else:
-            print(f"Failed to reconnect to {device}")
+            logger.warning("Failed to reconnect to %s", device)
             cap.release()
             return None
     
-    def capture_screen(self, device="/dev/video0", interval=5, output_dir="screenshots"):
+    def _upload_worker(self):
+        """Encode, save and upload queued frames until a None sentinel is received"""
+        while True:
+            item = self.upload_queue.get()
+            if item is None:
+                break
+            try:
+                self._process_frame(*item)
+            except Exception as e:
+                logger.error("Upload worker error: %s", e)
+    
+    def _process_frame(self, ts, frame, output_dir):
+        """Encode a frame and upload it to the API, saving it to temp storage only if the upload fails"""
+        # Generate filename with device ID and timestamp
+        filename = f"{self.device_id}-{ts}{self.image_ext}"
+        temp_filepath = os.path.join(self.temp_dir, filename)
+        
+        # Encode the frame once in memory
+        ok, buf = cv2.imencode(self.image_ext, frame, self.encode_params)
+        if not ok:
+            logger.error("Error: Could not encode frame.")
+            return
+        
+        # Optionally keep a permanent copy
+        if output_dir:
+            buf.tofile(os.path.join(output_dir, filename))
+        
+        # Upload the encoded image straight from memory
+        status_code = self._send_image(temp_filepath, data=buf.tobytes())
+        if status_code == 200:
+            # The network is back, flush any backlog in batches right away
+            if self.backlog_pending:
+                self.backlog_wakeup.set()
+            return
+        if self._is_rejected(status_code):
+            logger.warning("Server rejected %s, discarding it", filename)
+            return
+        
+        # Write to a .part file and rename it so a truncated image is never uploaded
+        buf.tofile(f"{temp_filepath}.part")
+        os.replace(f"{temp_filepath}.part", temp_filepath)
+        self.backlog_pending = True
+        logger.warning("Upload failed, saved temp file for retry: %s", filename)
+    
+    def _sleep_until(self, deadline, interval):
+        """Sleep until the deadline and return the next one, skipping ahead if it was missed"""
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+            return deadline + interval
+        return time.monotonic() + interval
+    
+    def capture_screen(self, device="/dev/video0", interval=5, output_dir=None):
         """
         Captures a screen from a video device at a specified interval.
-        The function checks if the captured image is completely black.
-        If it is, the image is not saved.
+        The function checks if the captured image is black or identical
+        to the previous one. If it is, the image is not saved.
+        Screenshots are only kept in temp storage until uploaded, unless
+        output_dir is given, in which case a permanent copy is saved there.
         Handles video source disconnections with automatic reconnection attempts.
         """
         # Create the output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
 
-        print("Screen capture process started. Press Ctrl+C to stop.")
+        logger.info("Screen capture process started. Press Ctrl+C to stop.")
         
         # Send initial heartbeat
-        self.send_heartbeat("online")
+        self.send_heartbeat("online", quick=True)
         
         cap = None
         
+        # Start background workers so uploads overlap with the next capture,
+        # plus one that retries images whose upload failed
+        self.backlog_stop.clear()
+        self.backlog_wakeup.clear()
+        self.upload_pool = ThreadPoolExecutor(max_workers=self.upload_workers + 1)
+        self.upload_futures = [self.upload_pool.submit(self._upload_worker)
+                               for _ in range(self.upload_workers)]
+        self.upload_futures.append(self.upload_pool.submit(self._backlog_worker))
+        
+        # Heartbeats and vitals updates run on their own threads so they overlap with capture and upload
+        self.request_stop.clear()
+        self.request_threads = [
+            threading.Thread(target=self._heartbeat_worker, name="prevex-heartbeat", daemon=True),
+            threading.Thread(target=self._vitals_worker, name="prevex-vitals", daemon=True),
+        ]
+        for thread in self.request_threads:
+            thread.start()
+        
+        # Capture on a fixed schedule so slow iterations don't stretch the period
+        next_capture = time.monotonic() + interval
+        
         try:
             while True:
                 # Initialize or reinitialize video capture
                 if cap is None or not cap.isOpened():
-                    cap = cv2.VideoCapture(device)
+                    cap = self._open_capture(device)
                     if not cap.isOpened():
-                        print(f"Error: Could not open video device {device}.")
+                        logger.error("Error: Could not open video device %s.", device)
                         cap = self.attempt_reconnection(device)
                         if cap is None:
                             # If reconnection failed, continue the loop to try again
@@ -217,14 +590,16 @@ class RaspberryPiSystem:
                     else:
                         self.is_connected = True
                         self.reconnect_attempts = 0
-                        print(f"Successfully connected to {device}")
+                        logger.info("Successfully connected to %s", device)
                 
-                # Read a frame from the video capture device
-                ret, frame = cap.read()
+                # Drain any buffered frame and decode only the latest one
+                for _ in range(2):
+                    cap.grab()
+                ret, frame = cap.retrieve()
                 
                 # Check if the frame was read successfully
                 if not ret:
-                    print("Error: Could not read a frame. Video source may be disconnected.")
+                    logger.error("Error: Could not read a frame. Video source may be disconnected.")
                     self.is_connected = False
                     cap.release()
                     cap = None
@@ -236,59 +611,82 @@ class RaspberryPiSystem:
                     else:
                         continue
 
-                # Check if the image is completely black
-                if frame.sum() == 0:
-                    time.sleep(interval)
+                # Check if the image is black (allowing for the capture noise floor)
+                if frame.max() < self.black_threshold:
+                    next_capture = self._sleep_until(next_capture, interval)
                     continue
 
-                # Generate filename with device ID and timestamp
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"{self.device_id}-{ts}.png"
-                filepath = os.path.join(output_dir, filename)
-                temp_filepath = os.path.join(self.temp_dir, filename)
-                
-                # Save the frame to both permanent and temp locations
-                cv2.imwrite(filepath, frame)
-                cv2.imwrite(temp_filepath, frame)
-                
-                print(f"Screenshot saved: {filename}")
-                
-                # Upload image to API
-                if self.upload_image(filepath):
-                    # If upload successful, remove temp file
+                # Skip frames identical to the last one sent, the screen is idle
+                frame_hash = hashlib.blake2b(frame, digest_size=8).digest()
+                if frame_hash != self.last_frame_hash:
+                    # Hand the frame to the upload workers, drop it if they are falling behind
+                    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
                     try:
-                        os.remove(temp_filepath)
-                        print(f"Removed temp file after successful upload: {filename}")
-                    except Exception as e:
-                        print(f"Error removing temp file: {e}")
-                else:
-                    print(f"Upload failed, keeping temp file: {filename}")
-                
-                # Send heartbeat every 30 seconds
-                if not self.last_heartbeat or (datetime.now() - self.last_heartbeat).seconds > 30:
-                    self.send_heartbeat("online")
+                        self.upload_queue.put_nowait((ts, frame.copy(), output_dir))
+                        self.last_frame_hash = frame_hash
+                    except queue.Full:
+                        logger.warning("Upload queue full, dropping frame: %s", ts)
                 
-                # Wait for the interval
-                time.sleep(interval)
+                # Wait for the remainder of the interval
+                next_capture = self._sleep_until(next_capture, interval)
 
         except KeyboardInterrupt:
-            print("Stopped by user.")
+            logger.info("Stopped by user.")
         except Exception as e:
-            print(f"An unexpected error occurred: {e}")
+            logger.error("An unexpected error occurred: %s", e)
         finally:
             # Send offline status
             try:
-                self.send_heartbeat("offline")
+                self.send_heartbeat("offline", quick=True)
             except:
                 pass
             
-            # Release the video capture and destroy all OpenCV windows
+            # Release the video capture (no HighGUI windows are used, so none to destroy)
             if cap is not None:
                 cap.release()
-            cv2.destroyAllWindows()
+            
+            # Stop the background workers, letting queued frames finish uploading (bounded by shutdown_timeout)
+            self.backlog_stop.set()
+            self.backlog_wakeup.set()
+            for _ in range(self.upload_workers):
+                try:
+                    self.upload_queue.put(None, timeout=self.upload_timeout)
+                except queue.Full:
+                    logger.error("Upload workers are not draining the queue, abandoning queued frames")
+                    break
+            _, still_running = wait(self.upload_futures, timeout=self.shutdown_timeout)
+            if still_running:
+                logger.warning("Upload workers still busy after %ss, not waiting for them", self.shutdown_timeout)
+            self.upload_pool.shutdown(wait=False)
+            
+            # Stop the request threads only after the uploads, so their vitals updates still get sent;
+            # they are daemon threads, so whatever is unsent after the timeout doesn't hold up exit
+            self.request_stop.set()
+            self.increment_wakeup.set()
+            deadline = time.monotonic() + self.request_shutdown_timeout
+            for thread in self.request_threads:
+                thread.join(max(0, deadline - time.monotonic()))
+            if self.pending_increments:
+                logger.warning("Dropping %s unsent vitals updates", self.pending_increments)
+            
+            # Close pooled HTTP connections
+            self.session.close()
+            self.status_session.close()
+
+def setup_logging(log_path="/var/log/prevex.log", level=logging.INFO):
+    """Log to a rotating file, falling back to stderr"""
+    try:
+        handler = RotatingFileHandler(log_path, maxBytes=1_000_000, backupCount=3)
+    except OSError:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(level)
 
 # Run the screen capture function
 if __name__ == "__main__":
+    setup_logging()
+    
     # Initialize the Raspberry Pi system
     pi_system = RaspberryPiSystem()
     